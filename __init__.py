@@ -51,16 +51,36 @@ def register():
     bpy.utils.register_class(DeltaWorksRevertOperator)
     bpy.utils.register_class(DeltaWorksDeleteOperator)
     bpy.utils.register_class(DeltaWorksNewOperator)
+    bpy.utils.register_class(DeltaWorksSquashOperator)
+    bpy.utils.register_class(DeltaWorksVerifyOperator)
     bpy.utils.register_class(DeltaWorksSettingsApplyOperator)
     bpy.utils.register_class(DeltaWorksSettingsCancelOperator)
     
-    # Assign props to object types
-    bpy.types.Object.deltaworks_list = bpy.props.CollectionProperty(type=PROP_DeltaWorksItem)
-    bpy.types.Object.deltaworks_cur = bpy.props.IntProperty(default=-1)
-    bpy.types.Object.deltaworks_selected = bpy.props.IntProperty(default=0)
-    bpy.types.Object.deltaworks_item = bpy.props.PointerProperty(type=PROP_DeltaWorksItem)
-    bpy.types.Object.deltaworks_settings = bpy.props.PointerProperty(type=PROP_DeltaWorksSettings)
-    bpy.types.Object.deltaworks_tmpsettings = bpy.props.PointerProperty(type=PROP_DeltaWorksSettings)
+    # Assign props to object and mesh types
+    for id_type in (bpy.types.Object, bpy.types.Mesh):
+        id_type.deltaworks_list = bpy.props.CollectionProperty(type=PROP_DeltaWorksItem)
+        id_type.deltaworks_cur = bpy.props.IntProperty(default=-1)
+        id_type.deltaworks_selected = bpy.props.IntProperty(default=0, update=update_selected)
+        id_type.deltaworks_item = bpy.props.PointerProperty(type=PROP_DeltaWorksItem)
+        id_type.deltaworks_settings = bpy.props.PointerProperty(type=PROP_DeltaWorksSettings)
+        id_type.deltaworks_tmpsettings = bpy.props.PointerProperty(type=PROP_DeltaWorksSettings)
+        id_type.deltaworks_migration = bpy.props.StringProperty(default="")
+    
+    # Payload persistence
+    bpy.app.handlers.save_pre.append(save_pre_handler)
+    bpy.app.handlers.save_post.append(save_post_handler)
+    bpy.app.handlers.load_pre.append(load_pre_handler)
+    bpy.app.handlers.load_post.append(load_post_handler)
+    bpy.app.timers.register(lambda: load_post_handler(None), first_interval=0.0)
+    prune_packed_cache()
+    
+    # Automatic versioning, which must run before save_pre_handler writes the payloads
+    bpy.app.handlers.save_pre.insert(bpy.app.handlers.save_pre.index(save_pre_handler), auto_version_save_handler)
+    bpy.app.timers.register(auto_version_timer, first_interval=auto_check_interval, persistent=True)
+    
+    # Viewport drawing
+    draw_handlers.append(bpy.types.SpaceView3D.draw_handler_add(draw_deltaworks_preview, (), "WINDOW", "POST_VIEW"))
+    draw_handlers.append(bpy.types.SpaceView3D.draw_handler_add(draw_deltaworks_diff, (), "WINDOW", "POST_VIEW"))
 
 def unregister():
     
@@ -79,6 +99,28 @@ def unregister():
     bpy.utils.unregister_class(DeltaWorksRevertOperator)
     bpy.utils.unregister_class(DeltaWorksDeleteOperator)
     bpy.utils.unregister_class(DeltaWorksNewOperator)
+    bpy.utils.unregister_class(DeltaWorksSquashOperator)
+    bpy.utils.unregister_class(DeltaWorksVerifyOperator)
     bpy.utils.unregister_class(DeltaWorksSettingsApplyOperator)
     bpy.utils.unregister_class(DeltaWorksSettingsCancelOperator)
-
+    
+    # Payload persistence
+    bpy.app.handlers.save_pre.remove(save_pre_handler)
+    bpy.app.handlers.save_post.remove(save_post_handler)
+    bpy.app.handlers.load_pre.remove(load_pre_handler)
+    bpy.app.handlers.load_post.remove(load_post_handler)
+    save_pre_handler(None)
+    purge_orphaned_files()
+    
+    # Automatic versioning
+    bpy.app.handlers.save_pre.remove(auto_version_save_handler)
+    if bpy.app.timers.is_registered(auto_version_timer):
+        bpy.app.timers.unregister(auto_version_timer)
+    
+    # Background work
+    shutdown_workers()
+    
+    # Viewport drawing
+    for handler in draw_handlers:
+        bpy.types.SpaceView3D.draw_handler_remove(handler, "WINDOW")
+    draw_handlers.clear()
@@ -18,16 +18,11 @@
 
 from .util import *
 from .props import *
-from .dictdiffer import diff
 
 import bpy
 import bmesh
 
-import pickle
 import zlib
-import time
-import hashlib
-import pathlib
 
 
 class DeltaWorksRevertOperator(bpy.types.Operator):
@@ -40,9 +35,10 @@ class DeltaWorksRevertOperator(bpy.types.Operator):
     
     def execute(self, context):
         obj = context.object
+        owner = get_history_owner(obj)
         
         # Build selected version
-        bmesh_dict = build_bmesh_dict(obj, obj.deltaworks_list[obj.deltaworks_selected].hash)
+        bmesh_dict = build_bmesh_dict(owner, owner.deltaworks_list[owner.deltaworks_selected].hash)
         
         # Set the object's mesh data to built version
         bm = dict_to_bmesh(bmesh_dict, bmesh.new())
@@ -52,7 +48,7 @@ class DeltaWorksRevertOperator(bpy.types.Operator):
         bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
         
         # Update cur to selected
-        obj.deltaworks_cur = obj.deltaworks_selected
+        owner.deltaworks_cur = owner.deltaworks_selected
         
         return {"FINISHED"}
 
@@ -67,46 +63,12 @@ class DeltaWorksDeleteOperator(bpy.types.Operator):
     
     def execute(self, context):
         obj = context.object
+        owner = get_history_owner(obj)
         
-        selected = obj.deltaworks_list[obj.deltaworks_selected]
-        parent = build_bmesh_dict(obj, selected.parent)
-        
-        for item in obj.deltaworks_list:
-            if item.parent == selected.hash:
-                # Recalculate the delta for all children of selected
-                child = build_bmesh_dict(obj, item.hash)
-                delta = diff(parent, child)
-                ser = pickle.dumps(list(delta))
-                ser_comp = zlib.compress(ser, 9)
-                new_hash = hashlib.md5(ser_comp).hexdigest().zfill(32)
-                
-                # Set the parent of all children of selected to selected's parent
-                for item2 in obj.deltaworks_list:
-                    if item2.parent == item.hash:
-                        item2.parent = new_hash
-                
-                item.hash = new_hash
-                set_delta_bytes(obj, item, ser_comp)
-                item.size = len(ser_comp)
-                item.parent = selected.parent
-        
-        # If last version is deleted, reset everything
-        if len(obj.deltaworks_list) == 1:
-            obj.property_unset("deltaworks_selected")
-            obj.property_unset("deltaworks_cur")
-            obj.deltaworks_list.clear()
-            
-        # Else, update cur and selected as required
-        else:
-            selected = obj.deltaworks_selected
-            
-            if obj.deltaworks_selected <= obj.deltaworks_cur:
-                obj.deltaworks_cur -= 1
-                
-            if obj.deltaworks_selected == len(obj.deltaworks_list) - 1:
-                obj.deltaworks_selected -= 1
-                
-            obj.deltaworks_list.remove(selected)
+        selected = owner.deltaworks_list[owner.deltaworks_selected]
+        
+        # Fold the selected version's delta into its children
+        squash_versions(owner, {item.hash for item in owner.deltaworks_list if item.hash != selected.hash})
         
         return {"FINISHED"}
 
@@ -122,69 +84,91 @@ class DeltaWorksNewOperator(bpy.types.Operator):
     
     def execute(self, context):
         obj = context.object
+        owner = get_history_owner(obj)
         
-        new_item = obj.deltaworks_list.add()
+        new_version(obj, owner.deltaworks_item.desc)
         
-        new_item.date = time.time()
-        new_item.desc = obj.deltaworks_item.desc
+        owner.property_unset("deltaworks_item")
         
-        if obj.deltaworks_cur >= 0:
-            new_item.parent = obj.deltaworks_list[obj.deltaworks_cur].hash
-            
-            # build parent
-            parent = build_bmesh_dict(obj, new_item.parent)
+        return {"FINISHED"}
+    
+
+class DeltaWorksSquashOperator(bpy.types.Operator):
+    """Squash runs of intermediate versions into single deltas"""
+    
+    # Blender meta
+    bl_idname = "mesh.deltaworks_squash"
+    bl_label = "Squash"
+    bl_options = {"REGISTER", "UNDO"}
+    
+    policy: bpy.props.EnumProperty(name="Policy",
+        items=[
+            ("RETENTION", "Retention", "Squash the intermediate versions not kept by the retention policy", "", 1),
+            ("ALL", "All", "Squash all intermediate versions", "", 2),
+        ],
+        default="RETENTION",
+        description="Which intermediate versions to squash")
+    
+    def execute(self, context):
+        obj = context.object
+        owner = get_history_owner(obj)
+        
+        size = sum([item.size for item in owner.deltaworks_list])
+        length = max_chain_length(owner)
+        
+        keep = get_structural_hashes(owner)
+        if self.policy == "RETENTION":
+            keep |= get_retained_hashes(owner)
             
-            # get diff of parent and self
-            bm = bmesh.new()
-            bm.from_mesh(obj.data)
-            bmesh_dict = bmesh_to_dict(bm)
-            delta = diff(parent, bmesh_dict)
+        removed = squash_versions(owner, keep)
+        
+        saved = size - sum([item.size for item in owner.deltaworks_list])
+        self.report({"INFO"}, f"Squashed {removed} versions, saved {sizeof_fmt(saved)}, "
+            f"longest revert chain {length} -> {max_chain_length(owner)}")
+        
+        return {"FINISHED"}
+        
+class DeltaWorksVerifyOperator(bpy.types.Operator):
+    """Verify every stored version and optionally repair the broken ones"""
+    
+    # Blender meta
+    bl_idname = "mesh.deltaworks_verify"
+    bl_label = "Verify"
+    bl_options = {"REGISTER", "UNDO"}
+    
+    repair: bpy.props.BoolProperty(name="Repair",
+        default=False,
+        description="Fix stored counts and remove the versions that can not be built")
+    
+    def execute(self, context):
+        obj = context.object
+        owner = get_history_owner(obj)
+        
+        count = len(owner.deltaworks_list)
+        problems = verify_versions(owner)
+        
+        for hash, problem in problems.items():
+            self.report({"WARNING"}, f"...{hash[-6:]}: {', '.join(problem)}")
+        
+        if len(problems) == 0:
+            self.report({"INFO"}, f"All {count} versions verified")
             
-            # serialize diff, compress, and store
-            ser = pickle.dumps(list(delta))
-            ser_comp = zlib.compress(ser, 9)
-            new_item.hash = hashlib.md5(ser_comp).hexdigest().zfill(32)
-            set_delta_bytes(obj, new_item, ser_comp)
-            new_item.size = len(ser_comp)
-            new_item.raw_size = len(zlib.compress(pickle.dumps(bmesh_dict), 9))
+        elif self.repair:
+            cur_hash = owner.deltaworks_list[owner.deltaworks_cur].hash if owner.deltaworks_cur >= 0 else ""
+            removed = repair_versions(owner, problems)
+            self.report({"INFO"}, f"Repaired {len(problems) - removed} versions, removed {removed} versions")
             
-            # populate mesh info
-            new_item.verts = len(bmesh_dict["verts"])
-            new_item.edges = len(bmesh_dict["edges"])
-            new_item.faces = len(bmesh_dict["faces"])           
+            if owner.deltaworks_cur >= 0 and owner.deltaworks_list[owner.deltaworks_cur].hash != cur_hash:
+                new_hash = owner.deltaworks_list[owner.deltaworks_cur].hash
+                self.report({"WARNING"}, f"The current version was removed, ...{new_hash[-6:]} is now current "
+                    "but the mesh may differ from it")
             
-            # free bmesh
-            bm.free()
-        
         else:
-            # build dict
-            bm = bmesh.new()
-            bm.from_mesh(obj.data)
-            bmesh_dict = bmesh_to_dict(bm)
+            self.report({"WARNING"}, f"{len(problems)} of {count} versions have problems")
             
-            # populate mesh info
-            new_item.verts = len(bmesh_dict["verts"])
-            new_item.edges = len(bmesh_dict["edges"])
-            new_item.faces = len(bmesh_dict["faces"])
-            
-            # serialize, compress, and store
-            ser = pickle.dumps(bmesh_dict)
-            ser_comp = zlib.compress(ser, 9)
-            new_item.hash = hashlib.md5(ser_comp).hexdigest().zfill(32)
-            set_delta_bytes(obj, new_item, ser_comp)
-            new_item.size = len(ser_comp)
-            new_item.raw_size = len(ser_comp)
-            
-            # free bmesh
-            bm.free()
-
-
-        obj.deltaworks_cur = list(obj.deltaworks_list).index(new_item)
-        obj.deltaworks_selected = obj.deltaworks_cur
-
-        obj.property_unset("deltaworks_item")
         return {"FINISHED"}
-        
+    
+
 class DeltaWorksSettingsApplyOperator(bpy.types.Operator):
     """Apply changes to the settings"""
     
@@ -193,40 +177,65 @@ class DeltaWorksSettingsApplyOperator(bpy.types.Operator):
     bl_label = "Apply"
     bl_options = {"REGISTER", "UNDO"}
     
+    discard_others: bpy.props.BoolProperty(name="Discard Other Histories",
+        default=False,
+        description="Delete the versions of other objects using the mesh when sharing its history")
+    
     def execute(self, context):
         
         obj = context.object
+        owner = get_history_owner(obj)
         
-        if obj.deltaworks_tmpsettings.storage != obj.deltaworks_settings.storage:
-            if obj.deltaworks_settings.storage == "PACKED":
-                unpack_deltas(obj)
+        # Find where the history moves to before changing anything
+        target = owner
+        if owner.deltaworks_tmpsettings.history_scope != owner.deltaworks_settings.history_scope:
+            target = obj.data if owner.deltaworks_tmpsettings.history_scope == "MESH" else obj
             
-            obj.deltaworks_settings.storage = obj.deltaworks_tmpsettings.storage
+            if len(target.deltaworks_list) > 0:
+                self.report({"ERROR"}, f"{target.name} already has versions")
+                return {"CANCELLED"}
             
-            if obj.deltaworks_settings.storage == "PACKED":
-                pack_deltas(obj)
-            
-        if obj.deltaworks_tmpsettings.external_location != obj.deltaworks_settings.external_location:
-            p_new = pathlib.Path(obj.deltaworks_tmpsettings.external_location)
-            p_old = pathlib.Path(obj.deltaworks_settings.external_location)
+            # Other users of the mesh would have their histories hidden behind the shared one. Those
+            # holding nothing but versions of this history are adopted, others must be discarded.
+            contained, diverged = get_other_histories(obj) if target == obj.data else ([], [])
+            if len(diverged) > 0 and not self.discard_others:
+                self.report({"ERROR"}, f"{', '.join([other.name for other in diverged])} also use {obj.data.name} and have "
+                    "versions of their own, apply with Discard Other Histories to drop them")
+                return {"CANCELLED"}
+        
+        settings = owner.deltaworks_settings
+        tmpsettings = owner.deltaworks_tmpsettings
+        
+        # Storage, location and compression changes are migrated in one resumable job
+        if (tmpsettings.storage != settings.storage or tmpsettings.compression_value != settings.compression_value or
+                (tmpsettings.storage == "EXTERNAL" and tmpsettings.external_location != settings.external_location)):
+            wm = context.window_manager
+            wm.progress_begin(0, len(owner.deltaworks_list))
             
-            p_new.mkdir(parents=True, exist_ok=True)
+            try:
+                migrate_deltas(owner, tmpsettings.storage, tmpsettings.external_location, tmpsettings.compression_value, progress=wm.progress_update)
+            except (OSError, zlib.error) as e:
+                self.report({"ERROR"}, f"Migration interrupted ({e}), apply again to resume or cancel to roll back")
+                return {"CANCELLED"}
+            finally:
+                wm.progress_end()
             
-            if obj.deltaworks_settings.storage == "EXTERNAL":
-                for f in p_old.glob("*.delta"):
-                    f.rename(p_new.joinpath(p.name))
+            commit_migration(owner)
             
-            obj.deltaworks_settings.external_location = obj.deltaworks_tmpsettings.external_location
+        else:
+            # The pending settings went back to the current ones
+            rollback_migration(owner)
+            settings.external_location = tmpsettings.external_location
             
-        if obj.deltaworks_tmpsettings.compression_value != obj.deltaworks_settings.compression_value:
-            if obj.deltaworks_settings.storage == "PACKED":
-                for item in obj.deltaworks_list:
-                    ser = zlib.decompress(get_delta(obj, item))
-                    ser_comp = zlib.compress(ser, obj.deltaworks_tmpsettings.compression_value)
-                    set_delta_bytes(obj, item, ser_comp)
-                    item.size = len(ser_comp)
+        for setting in ("retention_enabled", "retention_keep_all", "retention_keep_hourly", "auto_on_save", "auto_on_timer", "auto_interval", "auto_max_verts"):
+            setattr(owner.deltaworks_settings, setting, getattr(owner.deltaworks_tmpsettings, setting))
             
-            obj.deltaworks_settings.compression_value = obj.deltaworks_tmpsettings.compression_value
+        if target != owner:
+            for other in contained + diverged:
+                clear_history(other)
+                
+            owner.deltaworks_settings.history_scope = owner.deltaworks_tmpsettings.history_scope
+            move_history(owner, target)
             
         return {"FINISHED"}
     
@@ -242,9 +251,13 @@ class DeltaWorksSettingsCancelOperator(bpy.types.Operator):
     def execute(self, context):
         
         obj = context.object
+        owner = get_history_owner(obj)
+        
+        # Remove whatever an interrupted migration left behind
+        rollback_migration(owner)
         
-        for setting in obj.deltaworks_settings.__annotations__:
-            setattr(obj.deltaworks_tmpsettings, setting, getattr(obj.deltaworks_settings, setting))
+        for setting in owner.deltaworks_settings.__annotations__:
+            setattr(owner.deltaworks_tmpsettings, setting, getattr(owner.deltaworks_settings, setting))
         
         
         return {"FINISHED"}
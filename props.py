@@ -34,6 +34,8 @@ class PROP_DeltaWorksItem(bpy.types.PropertyGroup):
     verts: bpy.props.IntProperty(name="Verts", default=0)
     edges: bpy.props.IntProperty(name="Edges", default=0)
     faces: bpy.props.IntProperty(name="Faces", default=0)
+    preview: bpy.props.StringProperty(name="Preview", default="")
+    fingerprint: bpy.props.StringProperty(name="Fingerprint", default="")
     
 class PROP_DeltaWorksSettings(bpy.types.PropertyGroup):
     """PropertyGroup dataclass to store deltaworks settings"""
@@ -46,6 +48,22 @@ class PROP_DeltaWorksSettings(bpy.types.PropertyGroup):
         ],
         default="ALL",
         description = "Which versions to show with respect to the selected version")
+    
+    show_preview: bpy.props.BoolProperty(name="Show Preview",
+        default=True,
+        description="Draw a point cloud preview of the selected version in the viewport")
+    
+    show_diff: bpy.props.BoolProperty(name="Show Diff",
+        default=False,
+        description="Highlight the vertices that differ between the selected and the current version")
+        
+    history_scope: bpy.props.EnumProperty(name="History Scope",
+        items=[
+            ("OBJECT", "Object", "Versions are kept on the object", "", 1),
+            ("MESH", "Mesh", "Versions are kept on the mesh and shared by every object that uses it", "", 2),
+        ],
+        default="OBJECT",
+        description="Which datablock keeps the versions")
         
     storage: bpy.props.EnumProperty(name="Storage",
         items=[
@@ -65,3 +83,35 @@ class PROP_DeltaWorksSettings(bpy.types.PropertyGroup):
         min=0, 
         max=9,
         description="How much compression to apply (less is faster but larger deltas)")
+    
+    retention_enabled: bpy.props.BoolProperty(name="Automatic Retention",
+        default=False,
+        description="Squash the versions not kept by the retention policy whenever a new version is created")
+    
+    retention_keep_all: bpy.props.IntProperty(name="Keep All",
+        default=24,
+        min=0,
+        description="Every version younger than this many hours is kept")
+    
+    retention_keep_hourly: bpy.props.IntProperty(name="Keep Hourly",
+        default=7,
+        min=0,
+        description="One version per hour is kept for this many days, then one version per day")
+    
+    auto_on_save: bpy.props.BoolProperty(name="Version On Save",
+        default=False,
+        description="Create a version of the changed mesh whenever the file is saved")
+    
+    auto_on_timer: bpy.props.BoolProperty(name="Version On Timer",
+        default=False,
+        description="Create versions of the changed mesh in the background while it is idle")
+    
+    auto_interval: bpy.props.IntProperty(name="Auto Interval",
+        default=10,
+        min=1,
+        description="Minimum number of minutes between two automatic versions")
+    
+    auto_max_verts: bpy.props.IntProperty(name="Auto Vertex Limit",
+        default=20000,
+        min=0,
+        description="Meshes with more vertices are not versioned on the timer since capturing them would stall the interface")
@@ -21,9 +21,102 @@ from .props import *
 from .ops import *
 
 import bpy
+import gpu
+from gpu_extras.batch import batch_for_shader
 
+import numpy
 import time
 
+
+draw_handlers = []
+preview_batches = {}
+diff_batches = {}
+
+
+def get_uniform_color_shader():
+    """Returns the builtin uniform color shader across Blender versions"""
+    
+    try:
+        return gpu.shader.from_builtin("UNIFORM_COLOR")
+    except ValueError:
+        return gpu.shader.from_builtin("3D_UNIFORM_COLOR")
+
+def draw_points(obj, batch, color, size):
+    """Draws a batch of points in the object's space"""
+    
+    shader = get_uniform_color_shader()
+    
+    gpu.state.point_size_set(size)
+    gpu.matrix.push()
+    gpu.matrix.multiply_matrix(obj.matrix_world)
+    
+    shader.bind()
+    shader.uniform_float("color", color)
+    batch.draw(shader)
+    
+    gpu.matrix.pop()
+    gpu.state.point_size_set(1.0)
+
+def draw_deltaworks_preview():
+    """Draw handler that shows the preview of the selected version"""
+    
+    obj = bpy.context.object
+    if obj is None:
+        return
+    
+    owner = get_history_owner(obj)
+    if owner.deltaworks_cur < 0 or not owner.deltaworks_settings.show_preview:
+        return
+    
+    if owner.deltaworks_selected == owner.deltaworks_cur:
+        return
+    
+    deltaworks_item = owner.deltaworks_list[owner.deltaworks_selected]
+    key = (obj.name, deltaworks_item.hash)
+    
+    if key not in preview_batches:
+        coords = get_preview_coords(owner, deltaworks_item)
+        if coords is None:
+            return
+        
+        preview_batches.clear()
+        preview_batches[key] = batch_for_shader(get_uniform_color_shader(), "POINTS", {"pos": coords})
+    
+    draw_points(obj, preview_batches[key], (0.2, 0.6, 1.0, 0.8), 2.0)
+
+def draw_deltaworks_diff():
+    """Draw handler that highlights the vertices changed between the selected and current versions"""
+    
+    obj = bpy.context.object
+    if obj is None:
+        return
+    
+    owner = get_history_owner(obj)
+    if owner.deltaworks_cur < 0 or not owner.deltaworks_settings.show_diff:
+        return
+    
+    if owner.deltaworks_selected == owner.deltaworks_cur or obj.mode != "OBJECT":
+        return
+    
+    mesh = obj.data
+    key = (obj.name, owner.deltaworks_list[owner.deltaworks_selected].hash, owner.deltaworks_list[owner.deltaworks_cur].hash, len(mesh.vertices))
+    
+    if key not in diff_batches:
+        # Nothing is drawn until the worker thread has the changed indices ready
+        changed = get_changed_verts(owner, key[1], key[2])
+        if changed is None:
+            return
+        
+        coords = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", coords)
+        coords = coords.reshape(-1, 3)
+        coords = coords[changed[changed < len(coords)]]
+        
+        diff_batches.clear()
+        diff_batches[key] = batch_for_shader(get_uniform_color_shader(), "POINTS", {"pos": coords})
+        
+    draw_points(obj, diff_batches[key], (1.0, 0.5, 0.0, 1.0), 4.0)
+
 def draw_deltaworks_item(deltaworks_item, col):
     """Function that displays a deltaworks version information.
     Params:
@@ -109,15 +202,19 @@ class DeltaWorksListPanel(bpy.types.Panel):
 
     def draw(self, context):
         obj = context.object
-        if obj.deltaworks_cur < 0:
+        owner = get_history_owner(obj)
+        if owner.deltaworks_cur < 0:
             return
         
         layout = self.layout
-        deltaworks_item = obj.deltaworks_list[obj.deltaworks_selected]
+        deltaworks_item = owner.deltaworks_list[owner.deltaworks_selected]
         
         col = layout.column()
         
-        col.prop(obj.deltaworks_settings, "version_view", text="View")
+        row = col.row()
+        row.prop(owner.deltaworks_settings, "version_view", text="View")
+        row.prop(owner.deltaworks_settings, "show_preview", text="Preview")
+        row.prop(owner.deltaworks_settings, "show_diff", text="Diff")
         
         row = col.row()
         row.label(text=f"{' ' * 10}Date")
@@ -126,9 +223,9 @@ class DeltaWorksListPanel(bpy.types.Panel):
 
         col.template_list("DELTAWORKS_UL_DeltaWorksList", 
             "", 
-            obj, 
+            owner, 
             "deltaworks_list", 
-            obj, 
+            owner, 
             "deltaworks_selected", 
             #item_dyntip_propname="tooltip", 
             sort_lock=True)
@@ -140,7 +237,16 @@ class DeltaWorksListPanel(bpy.types.Panel):
         row = col.row()
         row.operator("mesh.deltaworks_revert", icon="RECOVER_LAST", text="Revert")
         row.operator("mesh.deltaworks_delete", icon="X", text="Delete")
-        row.enabled = (obj.mode == "OBJECT") and (obj.deltaworks_selected != obj.deltaworks_cur)
+        row.enabled = (obj.mode == "OBJECT") and (owner.deltaworks_selected != owner.deltaworks_cur)
+        
+        row = col.row()
+        row.operator("mesh.deltaworks_squash", icon="AUTOMERGE_ON", text="Squash").policy = "RETENTION"
+        row.operator("mesh.deltaworks_squash", icon="AUTOMERGE_OFF", text="Squash All").policy = "ALL"
+        row.enabled = (obj.mode == "OBJECT")
+        
+        row = col.row()
+        row.operator("mesh.deltaworks_verify", icon="CHECKMARK", text="Verify").repair = False
+        row.operator("mesh.deltaworks_verify", icon="TOOL_SETTINGS", text="Repair").repair = True
 
 
 class DeltaWorksCurrentPanel(bpy.types.Panel):
@@ -155,11 +261,12 @@ class DeltaWorksCurrentPanel(bpy.types.Panel):
     
     def draw(self, context):
         obj = context.object
-        if obj.deltaworks_cur < 0:
+        owner = get_history_owner(obj)
+        if owner.deltaworks_cur < 0:
             return
         
         layout = self.layout
-        deltaworks_item = obj.deltaworks_list[obj.deltaworks_cur]
+        deltaworks_item = owner.deltaworks_list[owner.deltaworks_cur]
         
         col = layout.column()
         
@@ -178,9 +285,10 @@ class DeltaWorksNewPanel(bpy.types.Panel):
     
     def draw(self, context):
         obj = context.object
+        owner = get_history_owner(obj)
         layout = self.layout
         
-        layout.prop(obj.deltaworks_item, "desc", text="Description")
+        layout.prop(owner.deltaworks_item, "desc", text="Description")
         
         layout.separator(factor=2.0)
         
@@ -201,20 +309,49 @@ class DeltaWorksSettingsPanel(bpy.types.Panel):
     
     def draw(self, context):
         obj = context.object
+        owner = get_history_owner(obj)
         layout = self.layout
         
         row = layout.row()
-        row.prop(obj.deltaworks_tmpsettings, "storage", text="Storage Type")
+        row.prop(owner.deltaworks_tmpsettings, "history_scope", text="History Scope")
+        row.enabled = isinstance(obj.data, bpy.types.Mesh)
+        
+        row = layout.row()
+        row.prop(owner.deltaworks_tmpsettings, "storage", text="Storage Type")
         
         row = layout.row()
-        row.prop(obj.deltaworks_tmpsettings, "external_location", text="External Location")
-        row.enabled = (obj.deltaworks_tmpsettings.external_location != "PACKED")
+        row.prop(owner.deltaworks_tmpsettings, "external_location", text="External Location")
+        row.enabled = (owner.deltaworks_tmpsettings.external_location != "PACKED")
         
         row = layout.row()
-        row.prop(obj.deltaworks_tmpsettings, "compression_value", text="Compression Value", slider=True)
+        row.prop(owner.deltaworks_tmpsettings, "compression_value", text="Compression Value", slider=True)
+        
+        row = layout.row()
+        row.prop(owner.deltaworks_tmpsettings, "retention_enabled", text="Automatic Retention")
+        
+        row = layout.row(align=True)
+        row.prop(owner.deltaworks_tmpsettings, "retention_keep_all", text="Keep All (Hours)")
+        row.prop(owner.deltaworks_tmpsettings, "retention_keep_hourly", text="Keep Hourly (Days)")
+        
+        row = layout.row(align=True)
+        row.prop(owner.deltaworks_tmpsettings, "auto_on_save", text="On Save")
+        row.prop(owner.deltaworks_tmpsettings, "auto_on_timer", text="On Timer")
+        row.prop(owner.deltaworks_tmpsettings, "auto_interval", text="Every (Minutes)")
+        
+        row = layout.row()
+        row.prop(owner.deltaworks_tmpsettings, "auto_max_verts", text="Timer Vertex Limit")
         
         layout.separator(factor=2.0)
         
+        if owner.deltaworks_migration != "":
+            row = layout.row()
+            row.label(text="Migration interrupted, apply to resume or cancel to roll back", icon="ERROR")
+        
         row = layout.row()
-        row.operator("mesh.deltaworks_settings_apply", icon="CHECKMARK", text="Apply")
+        row.operator("mesh.deltaworks_settings_apply", icon="CHECKMARK", text="Apply").discard_others = False
         row.operator("mesh.deltaworks_settings_cancel", icon="X", text="Cancel")
+        
+        # Sharing the mesh history needs consent before other objects lose versions of their own
+        if owner == obj and owner.deltaworks_tmpsettings.history_scope == "MESH" and len(get_other_histories(obj)[1]) > 0:
+            row = layout.row()
+            row.operator("mesh.deltaworks_settings_apply", icon="TRASH", text="Apply and Discard Other Histories").discard_others = True
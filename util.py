@@ -22,12 +22,81 @@ import bpy
 import bmesh
 from mathutils import Vector
 
+import numpy
+import math
 import pickle
 import zlib
+import time
+import hashlib
+import pathlib
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bpy.app.handlers import persistent
 
 
 deltaworks_home = bpy.utils.script_path_user() + "/addons/DeltaWorks/"
 
+# Maximum number of points kept in a version preview
+preview_point_count = 4000
+
+# Packed deltas and previews are kept here rather than on the object so that undo steps
+# only snapshot the version metadata. They are written to the object around saves.
+packed_store = {}
+preview_store = {}
+
+# Every packed payload is also written here when it is created, since autosaves and quit.blend
+# are written from the undo memory, which does not hold the payloads. Entries untouched for
+# packed_cache_days are pruned when the add-on is registered.
+packed_cache_location = deltaworks_home + "packed/"
+packed_cache_days = 30
+
+# External delta files no longer referenced by any version, and the external delta files
+# referenced by the .blend files saved or loaded in this session. Orphaned files are only
+# removed once the undo history is discarded, and never while a file on disk refers to them.
+orphaned_files = set()
+saved_references = set()
+
+preview_executor = ThreadPoolExecutor(max_workers=1)
+pending_previews = []
+
+# Vertex indices moved or added by each delta, keyed by hash, and their unions between two versions
+changed_verts_cache = {}
+changed_verts_cache_limit = 256
+changed_verts_results = {}
+changed_verts_jobs = {}
+diff_executor = ThreadPoolExecutor(max_workers=1)
+
+# Decompressed deltas keyed by hash, shared by reconstruction and prefetching
+delta_executor = ThreadPoolExecutor()
+delta_cache = OrderedDict()
+delta_cache_lock = threading.Lock()
+delta_cache_size = 0
+delta_cache_limit = 256 * 1024 * 1024
+
+# Reads in flight keyed by hash, so a delta is never decompressed twice at once
+delta_futures = {}
+delta_futures_lock = threading.RLock()
+
+# Prefetching runs on its own single worker and is cancelled when the selection moves on
+prefetch_executor = ThreadPoolExecutor(max_workers=1)
+prefetch_futures = set()
+
+# Number of deltas converted between two journal writes during a storage migration
+migration_batch_size = 64
+
+# Seconds between two checks for automatic versioning
+auto_check_interval = 10.0
+
+auto_executor = ThreadPoolExecutor(max_workers=1)
+auto_jobs = {}
+auto_fingerprints = {}
+
+# Retention squashes of automatic versions, encoded on the auto executor
+retention_jobs = {}
+
 
 def sizeof_fmt(num, suffix="B"):
     """Makes a number human readable
@@ -145,8 +214,8 @@ def dict_to_bmesh(d, bm):
     return bm
 
 
-def build_bmesh_dict(obj, hash):
-    """Builds a bmesh_dict of the version with the provided hash"""
+def get_chain_items(obj, hash):
+    """Returns the version items from the root down to the version with the provided hash"""
     
     delta_items = list(obj.deltaworks_list)
     delta_hashes = [item.hash for item in delta_items]
@@ -158,31 +227,178 @@ def build_bmesh_dict(obj, hash):
     while cur_item.parent != "":
         cur_item = delta_items[delta_hashes.index(cur_item.parent)]
         items.insert(0, cur_item)
+        
+    return items
+
+def build_bmesh_dict(obj, hash):
+    """Builds a bmesh_dict of the version with the provided hash
     
-    bmesh_dict = pickle.loads(zlib.decompress(get_delta_bytes(obj, items[0])))
+    Every delta in the chain is read and decompressed concurrently while the
+    patches are applied in order as soon as each one is ready.
+    """
     
-    for item in items[1:]:
-        patch(pickle.loads(zlib.decompress(get_delta_bytes(obj, item))), bmesh_dict, in_place=True)
+    return build_bmesh_dict_from_readers([(item.hash, get_delta_reader(obj, item)) for item in get_chain_items(obj, hash)])
+
+def build_bmesh_dict_from_readers(readers):
+    """Builds a bmesh_dict from the (hash, reader) pairs of a chain, see get_delta_reader
+    
+    Does not touch Blender data so it can run on a worker thread.
+    """
+    
+    futures = [submit_read_delta(hash, reader) for hash, reader in readers]
+    
+    bmesh_dict = pickle.loads(futures[0].result())
+    
+    for future in futures[1:]:
+        patch(pickle.loads(future.result()), bmesh_dict, in_place=True)
         
     return bmesh_dict
+
+def read_delta(hash, reader):
+    """Returns the decompressed delta with the provided hash, calling reader for its bytes on a cache miss
     
-def get_delta_bytes(obj, deltaworks_item):
-    """Returns the delta in bytes form for the provided version item"""
+    Safe to call from worker threads. The serialized form is cached rather than the delta
+    itself since patching shares objects between the delta and the bmesh_dict.
+    """
+    
+    global delta_cache_size
+    
+    with delta_cache_lock:
+        if hash in delta_cache:
+            delta_cache.move_to_end(hash)
+            return delta_cache[hash]
+    
+    ser = zlib.decompress(reader())
+    
+    with delta_cache_lock:
+        if hash not in delta_cache:
+            delta_cache[hash] = ser
+            delta_cache_size += len(ser)
+        
+        while delta_cache_size > delta_cache_limit and len(delta_cache) > 1:
+            delta_cache_size -= len(delta_cache.popitem(last=False)[1])
+            
+    return ser
+
+def submit_read_delta(hash, reader, prefetch=False):
+    """Returns a future for read_delta, reusing the read already in flight for the same hash
+    
+    A prefetch that has not started yet is cancelled and resubmitted on the delta executor so
+    that a reconstruction never waits behind the prefetch queue.
+    """
+    
+    with delta_futures_lock:
+        future = delta_futures.get(hash)
+        
+        if future is not None and not prefetch and future in prefetch_futures and future.cancel():
+            future = None
+            
+        if future is None:
+            future = (prefetch_executor if prefetch else delta_executor).submit(read_delta, hash, reader)
+            delta_futures[hash] = future
+            
+            if prefetch:
+                prefetch_futures.add(future)
+                
+    future.add_done_callback(lambda done: forget_read_delta(hash, done))
+    
+    return future
+
+def forget_read_delta(hash, future):
+    """Done callback that stops tracking a finished or cancelled read"""
+    
+    with delta_futures_lock:
+        if delta_futures.get(hash) is future:
+            del delta_futures[hash]
+            
+        prefetch_futures.discard(future)
+
+def prefetch_versions(obj, indices):
+    """Reads and decompresses the chains of the versions at the provided indices in the background
+    
+    Prefetches for a previous selection that have not started yet are cancelled.
+    """
+    
+    with delta_futures_lock:
+        for future in list(prefetch_futures):
+            future.cancel()
+    
+    for index in indices:
+        if index < 0 or index >= len(obj.deltaworks_list):
+            continue
+        
+        for item in get_chain_items(obj, obj.deltaworks_list[index].hash):
+            if item.hash not in delta_cache and item.hash not in delta_futures:
+                submit_read_delta(item.hash, get_delta_reader(obj, item), prefetch=True)
+
+def get_delta_reader(obj, deltaworks_item):
+    """Returns a callable that reads the delta bytes of the provided version item
+    
+    The callable does not touch Blender data so it can run on a worker thread.
+    """
     
     if obj.deltaworks_settings.storage == "PACKED":
-        return bytes.fromhex(deltaworks_item.delta)
+        if deltaworks_item.hash in packed_store:
+            delta_bytes = packed_store[deltaworks_item.hash]
+            return lambda: delta_bytes
+        
+        if deltaworks_item.delta != "":
+            delta_bytes = bytes.fromhex(deltaworks_item.delta)
+            return lambda: delta_bytes
+        
+        # Raises FileNotFoundError if the payload is nowhere to be found
+        return get_packed_cache_path(deltaworks_item.hash).read_bytes
+    
+    p = pathlib.Path(obj.deltaworks_settings.external_location)
     
+    return p.joinpath(f"{deltaworks_item.hash}.delta").read_bytes
+    
+def get_delta_bytes(obj, deltaworks_item):
+    """Returns the delta in bytes form for the provided version item
+    
+    Raises FileNotFoundError if the payload is missing.
+    """
+    
+    return get_delta_reader(obj, deltaworks_item)()
+    
+def get_packed_cache_path(hash):
+    """Returns the path of the packed cache entry for the provided hash"""
+    
+    return pathlib.Path(packed_cache_location).joinpath(f"{hash}.delta")
+    
+def write_packed_cache(hash, delta_bytes):
+    """Writes a packed payload to the packed cache, or refreshes the entry if it already exists"""
+    
+    p = get_packed_cache_path(hash)
+    
+    if p.exists():
+        p.touch()
     else:
-        p = pathlib.Path(obj.deltaworks_settings.external_location)
-        f_name = f"{deltaworks_item.hash}.delta"
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(delta_bytes)
         
-        return p.joinpath(f_name).read_bytes()
+def prune_packed_cache():
+    """Removes the packed cache entries that have not been written or loaded for packed_cache_days"""
+    
+    p = pathlib.Path(packed_cache_location)
+    if not p.is_dir():
+        return
+    
+    cutoff = time.time() - packed_cache_days * 86400
+    for f in p.iterdir():
+        try:
+            if f.stat().st_mtime < cutoff:
+                f.unlink()
+        except OSError:
+            pass
     
 def set_delta_bytes(obj, deltaworks_item, delta_bytes):
     """Sets the delta in bytes form for the provided version item"""
 
     if obj.deltaworks_settings.storage == "PACKED":
-        deltaworks_item.delta = delta_bytes.hex()
+        packed_store[deltaworks_item.hash] = delta_bytes
+        write_packed_cache(deltaworks_item.hash, delta_bytes)
+        deltaworks_item.delta = ""
     
     else:
         p = pathlib.Path(obj.deltaworks_settings.external_location)
@@ -191,23 +407,235 @@ def set_delta_bytes(obj, deltaworks_item, delta_bytes):
         
         deltaworks_item.delta = ""
         
-def pack_deltas(obj):
-    """Moves all deltas from an external location into the object datablock"""
+def discard_delta_bytes(obj, deltaworks_item):
+    """Releases the stored delta of the provided version item
     
-    p = pathlib.Path(obj.deltaworks_settings.external_location)
+    External files are only removed once the undo history is discarded, so that undoing a
+    versioning operation can still find them.
+    """
+    
+    deltaworks_item.delta = ""
+    
+    if obj.deltaworks_settings.storage == "EXTERNAL":
+        p = pathlib.Path(obj.deltaworks_settings.external_location)
+        orphaned_files.add(p.joinpath(f"{deltaworks_item.hash}.delta"))
+        orphaned_files.add(p.joinpath(f"{deltaworks_item.hash}.preview"))
+        
+def set_item_delta(obj, deltaworks_item, delta_bytes):
+    """Replaces the delta of the provided version item, rehashing it and returning the new hash
+    
+    References to the old hash held by other items are not updated.
+    """
+    
+    preview_bytes = get_preview_bytes(obj, deltaworks_item)
+    discard_delta_bytes(obj, deltaworks_item)
+    deltaworks_item.hash = hashlib.md5(delta_bytes).hexdigest().zfill(32)
+    
+    if preview_bytes is not None:
+        set_preview_bytes(obj, deltaworks_item.hash, preview_bytes)
+        
+    set_delta_bytes(obj, deltaworks_item, delta_bytes)
+    deltaworks_item.size = len(delta_bytes)
+    
+    return deltaworks_item.hash
+        
+def get_migration_journal(obj):
+    """Returns the path of the journal of obj's pending migration, or None if it has none"""
+    
+    if obj.deltaworks_migration == "":
+        return None
+    
+    return pathlib.Path(deltaworks_home).joinpath("migrations", f"{obj.deltaworks_migration}.json")
+
+def read_migration_journal(obj):
+    """Returns the journal of obj's pending migration, or None if it has none
+    
+    The journal holds the target storage settings and the new hash and size of every delta
+    migrated so far, keyed by the old hash.
+    """
+    
+    journal_path = get_migration_journal(obj)
+    if journal_path is None or not journal_path.exists():
+        return None
+    
+    try:
+        return json.loads(journal_path.read_text())
+    except ValueError:
+        return None
+    
+def write_migration_journal(obj, journal):
+    """Replaces the journal of obj's pending migration in one step so it is never left half written"""
+    
+    journal_path = get_migration_journal(obj)
+    journal_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    tmp_path = journal_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(journal))
+    tmp_path.replace(journal_path)
+    
+def remove_migration_journal(obj):
+    """Forgets obj's pending migration"""
+    
+    journal_path = get_migration_journal(obj)
+    if journal_path is not None:
+        journal_path.unlink(missing_ok=True)
+        
+    obj.property_unset("deltaworks_migration")
+
+def get_migration_target(storage, location, hash):
+    """Returns where a migrated delta is written, a path for external storage and None for packed storage"""
+    
+    return pathlib.Path(location).joinpath(f"{hash}.delta") if storage == "EXTERNAL" else None
+
+def migrate_delta(hash, reader, storage, location, level):
+    """Converts one delta for the provided storage settings and returns its new hash and size
+    
+    Runs on a worker thread. A level of None keeps the current compression.
+    """
+    
+    delta_bytes = reader()
+    
+    if level is not None:
+        delta_bytes = zlib.compress(zlib.decompress(delta_bytes), level)
+        hash = hashlib.md5(delta_bytes).hexdigest().zfill(32)
+    
+    target = get_migration_target(storage, location, hash)
+    if target is None:
+        packed_store[hash] = delta_bytes
+        write_packed_cache(hash, delta_bytes)
+    else:
+        target.write_bytes(delta_bytes)
+        
+    return hash, len(delta_bytes)
+
+def migrate_deltas(obj, storage, location, level, progress=None):
+    """Moves every delta of obj to the provided storage settings
+    
+    The deltas are converted in parallel batches and written next to the originals, which are
+    left untouched until commit_migration is called, so an interrupted migration never leaves
+    items half-migrated. Each owner has at most one pending migration, recorded in a journal:
+    migrating again to the same settings resumes where it stopped, also when versions were
+    added or removed since, while migrating to other settings rolls the pending one back first.
+    progress is called with the number of finished items.
+    """
+    
+    journal = read_migration_journal(obj)
+    
+    if journal is not None and [journal["storage"], journal["location"], journal["level"]] != [storage, location, level]:
+        rollback_migration(obj)
+        journal = None
+        
+    if journal is None:
+        obj.deltaworks_migration = uuid.uuid4().hex
+        journal = {"storage": storage, "location": location, "level": level, "deltas": {}}
+        
+    deltas = journal["deltas"]
+    
+    if storage == "EXTERNAL":
+        pathlib.Path(location).mkdir(parents=True, exist_ok=True)
+    
+    recompress = level if level != obj.deltaworks_settings.compression_value else None
+    
+    # Skip the items whose migrated delta survived a previous attempt
+    pending = []
     for item in obj.deltaworks_list:
-        set_delta_bytes(obj, item, p.joinpath(f"{item.hash}.delta").read_bytes())
-        p.joinpath(f"{item.hash}.delta").unlink()
+        if item.hash in deltas:
+            target = get_migration_target(storage, location, deltas[item.hash][0])
+            if (target is None and deltas[item.hash][0] in packed_store) or (target is not None and target.exists()):
+                continue
+            
+        pending.append((item.hash, get_delta_reader(obj, item)))
         
-def unpack_deltas(obj):
-    """Moves all deltas from the object datablock to an external location"""
+    done = len(obj.deltaworks_list) - len(pending)
     
-    p = pathlib.Path(obj.deltaworks_settings.external_location)
-    p.mkdir(parents=True, exist_ok=True)
+    try:
+        for start in range(0, len(pending), migration_batch_size):
+            batch = pending[start:start + migration_batch_size]
+            futures = {delta_executor.submit(migrate_delta, hash, reader, storage, location, recompress): hash for hash, reader in batch}
+            
+            # Record every item of the batch that finished before raising for the first failure
+            error = None
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                
+                deltas[futures[future]] = future.result()
+                done += 1
+                
+                if progress is not None:
+                    progress(done)
+                    
+            if error is not None:
+                raise error
+                
+    finally:
+        write_migration_journal(obj, journal)
+        
+def commit_migration(obj):
+    """Switches obj over to the deltas written by migrate_deltas and releases the old ones"""
+    
+    journal = read_migration_journal(obj)
+    storage, location, level, deltas = journal["storage"], journal["location"], journal["level"], journal["deltas"]
+    
+    hash_map = {}
+    previews = {}
     for item in obj.deltaworks_list:
-        p.joinpath(f"{item.hash}.delta").write_bytes(get_delta_bytes(obj, item))
+        new_hash, size = deltas[item.hash]
+        previews[new_hash] = get_preview_bytes(obj, item)
+        
+        if obj.deltaworks_settings.storage == "EXTERNAL" and (storage == "PACKED" or new_hash != item.hash or
+                pathlib.Path(location) != pathlib.Path(obj.deltaworks_settings.external_location)):
+            discard_delta_bytes(obj, item)
+            
+        hash_map[item.hash] = new_hash
+        item.hash = new_hash
+        item.size = size
         item.delta = ""
         
+    for item in obj.deltaworks_list:
+        item.parent = hash_map.get(item.parent, item.parent)
+        
+    obj.deltaworks_settings.storage = storage
+    obj.deltaworks_settings.external_location = location
+    obj.deltaworks_settings.compression_value = level
+    
+    # Previews follow the deltas to the new storage
+    for new_hash, preview_bytes in previews.items():
+        if preview_bytes is not None:
+            try:
+                set_preview_bytes(obj, new_hash, preview_bytes)
+            except OSError:
+                pass
+            
+    # Versions removed while the migration was pending leave their migrated deltas behind
+    remove_migration_targets(storage, location, [new_hash for old_hash, (new_hash, size) in deltas.items() if old_hash not in hash_map])
+    remove_migration_journal(obj)
+    
+def rollback_migration(obj):
+    """Removes the deltas written by obj's pending migration, if it has one"""
+    
+    journal = read_migration_journal(obj)
+    
+    if journal is not None:
+        remove_migration_targets(journal["storage"], journal["location"], [new_hash for new_hash, size in journal["deltas"].values()])
+        
+    remove_migration_journal(obj)
+    
+def remove_migration_targets(storage, location, hashes):
+    """Removes the migrated external deltas of the provided hashes that no version or saved file refers to
+    
+    Deltas are content addressed and histories may share a location, so the same file can
+    belong to the versions of another object.
+    """
+    
+    referenced = saved_references | get_referenced_files()
+    
+    for hash in hashes:
+        target = get_migration_target(storage, location, hash)
+        if target is not None and target not in referenced:
+            target.unlink(missing_ok=True)
+        
 def is_in_lineage(obj, hash1, hash2):
     """Returns True if the versions represented by hash1 and hash2 share a common lineage and False otherwise"""
     delta_items = list(obj.deltaworks_list)
@@ -231,7 +659,1022 @@ def is_in_lineage(obj, hash1, hash2):
             return True
         cur_item = delta_items[delta_hashes.index(cur_item.parent)]    
         
-    return False    
+    return False
+
+
+def chain_length(obj, hash):
+    """Returns the number of deltas that must be applied to build the version with the provided hash"""
+    
+    delta_items = list(obj.deltaworks_list)
+    delta_hashes = [item.hash for item in delta_items]
+    
+    cur_item = delta_items[delta_hashes.index(hash)]
+    length = 1
+    
+    while cur_item.parent != "":
+        cur_item = delta_items[delta_hashes.index(cur_item.parent)]
+        length += 1
+        
+    return length
+
+def max_chain_length(obj):
+    """Returns the longest revert chain of all of the versions"""
+    
+    return max([chain_length(obj, item.hash) for item in obj.deltaworks_list], default=0)
+
+def get_structural_hashes(obj):
+    """Returns the hashes of the versions that can not be squashed
+    
+    These are the roots, the leaves, the branch points and the current version.
+    """
+    
+    child_counts = {item.hash: 0 for item in obj.deltaworks_list}
+    for item in obj.deltaworks_list:
+        if item.parent in child_counts:
+            child_counts[item.parent] += 1
+    
+    keep = {item.hash for item in obj.deltaworks_list if item.parent == "" or child_counts[item.hash] != 1}
+    
+    if obj.deltaworks_cur >= 0:
+        keep.add(obj.deltaworks_list[obj.deltaworks_cur].hash)
+        
+    return keep
+
+def get_retained_hashes(obj, now=None):
+    """Returns the hashes of the versions kept by the retention policy
+    
+    Every version younger than retention_keep_all hours is kept, then the newest version of each
+    hour up to retention_keep_hourly days, then the newest version of each day.
+    """
+    
+    settings = obj.deltaworks_settings
+    now = time.time() if now is None else now
+    
+    keep = set()
+    buckets = set()
+    
+    for item in sorted(obj.deltaworks_list, key=lambda x: x.date, reverse=True):
+        age = now - item.date
+        
+        if age < settings.retention_keep_all * 3600:
+            keep.add(item.hash)
+            continue
+        
+        local = time.localtime(item.date)
+        
+        if age < settings.retention_keep_hourly * 86400:
+            bucket = ("HOUR", local.tm_year, local.tm_yday, local.tm_hour)
+        else:
+            bucket = ("DAY", local.tm_year, local.tm_yday)
+            
+        if bucket not in buckets:
+            buckets.add(bucket)
+            keep.add(item.hash)
+            
+    return keep
+    
+def plan_squash(obj, keep):
+    """Returns the plan for removing every version of obj whose hash is not in keep, or None if none would be
+    
+    The plan holds the parent of every version, the removed hashes and, for every kept version whose
+    parent is removed, its hash, its new parent and the (hash, reader) chains of both, which is
+    everything encode_squash needs.
+    """
+    
+    parents = {item.hash: item.parent for item in obj.deltaworks_list}
+    removed = {hash for hash in parents if hash not in keep}
+    
+    if not removed:
+        return None
+    
+    def resolve(hash):
+        while hash in removed:
+            hash = parents[hash]
+        return hash
+    
+    def chain(hash):
+        return [(item.hash, get_delta_reader(obj, item)) for item in get_chain_items(obj, hash)] if hash != "" else []
+    
+    rebased = []
+    for hash, parent in parents.items():
+        if hash in removed or parent not in removed:
+            continue
+        
+        rebased.append((hash, resolve(parent), chain(hash), chain(resolve(parent))))
+        
+    return {"parents": parents, "removed": removed, "rebased": rebased}
+
+def encode_squash(rebased, level):
+    """Returns the compressed delta of every rebased version of a squash plan against its new parent
+    
+    Does not touch Blender data so it can run on a worker thread.
+    """
+    
+    deltas = []
+    for hash, parent, child_readers, parent_readers in rebased:
+        child = build_bmesh_dict_from_readers(child_readers)
+        
+        if parent == "":
+            ser = pickle.dumps(child)
+        else:
+            ser = pickle.dumps(list(diff(build_bmesh_dict_from_readers(parent_readers), child)))
+            
+        deltas.append(zlib.compress(ser, level))
+        
+    return deltas
+
+def apply_squash(obj, plan, deltas):
+    """Carries out a squash plan with the deltas returned by encode_squash and returns how many versions were removed
+    
+    The history must not have changed since the plan was made.
+    """
+    
+    parents = plan["parents"]
+    removed = plan["removed"]
+    
+    def resolve(hash):
+        while hash in removed:
+            hash = parents[hash]
+        return hash
+    
+    cur_hash = obj.deltaworks_list[obj.deltaworks_cur].hash if obj.deltaworks_cur >= 0 else ""
+    selected_hash = obj.deltaworks_list[obj.deltaworks_selected].hash if 0 <= obj.deltaworks_selected < len(obj.deltaworks_list) else ""
+    
+    items = {item.hash: item for item in obj.deltaworks_list}
+    
+    hash_map = {}
+    for (hash, parent, child_readers, parent_readers), ser_comp in zip(plan["rebased"], deltas):
+        item = items[hash]
+        item.parent = parent
+        hash_map[hash] = set_item_delta(obj, item, ser_comp)
+        
+    for item in obj.deltaworks_list:
+        item.parent = hash_map.get(item.parent, item.parent)
+    
+    for index in reversed(range(len(obj.deltaworks_list))):
+        item = obj.deltaworks_list[index]
+        if item.hash in removed:
+            discard_delta_bytes(obj, item)
+            obj.deltaworks_list.remove(index)
+            
+    # Update cur and selected as required
+    if len(obj.deltaworks_list) == 0:
+        obj.property_unset("deltaworks_cur")
+        obj.property_unset("deltaworks_selected")
+        
+    else:
+        delta_hashes = [item.hash for item in obj.deltaworks_list]
+        cur_hash = resolve(cur_hash)
+        cur_hash = hash_map.get(cur_hash, cur_hash)
+        
+        # Set cur first, assigning selected runs update_selected which reads cur
+        obj.deltaworks_cur = delta_hashes.index(cur_hash) if cur_hash in delta_hashes else -1
+        
+        if selected_hash in removed or selected_hash == "":
+            obj.deltaworks_selected = max(0, min(obj.deltaworks_selected, len(delta_hashes) - 1))
+        else:
+            obj.deltaworks_selected = delta_hashes.index(hash_map.get(selected_hash, selected_hash))
+        
+    return len(removed)
+
+def squash_versions(obj, keep):
+    """Removes every version whose hash is not in keep and returns how many were removed
+    
+    The deltas of removed versions are composed into the deltas of their nearest kept
+    descendants, so every kept version still builds to the same mesh.
+    """
+    
+    plan = plan_squash(obj, keep)
+    if plan is None:
+        return 0
+    
+    return apply_squash(obj, plan, encode_squash(plan["rebased"], obj.deltaworks_settings.compression_value))
+
+def apply_retention_policy(obj):
+    """Squashes every version that is not kept by the retention policy and returns how many were removed"""
+    
+    return squash_versions(obj, get_structural_hashes(obj) | get_retained_hashes(obj))
+
+
+def make_preview(coords, path):
+    """Decimates a flat array of vertex coordinates into a compressed point cloud and writes it to path
+    
+    Runs on a worker thread. The points are quantized to 16 bits per axis within their bounding
+    box, which is stored in front of them. Returns None for an empty mesh.
+    """
+    
+    points = coords.reshape(-1, 3)
+    if len(points) == 0:
+        return None
+    
+    points = points[::math.ceil(len(points) / preview_point_count)]
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    scale = numpy.where(high > low, high - low, 1.0)
+    
+    quantized = numpy.round((points - low) / scale * 65535).astype(numpy.uint16)
+    preview_bytes = zlib.compress(numpy.concatenate([low, high]).astype(numpy.float32).tobytes() + quantized.tobytes(), 1)
+    
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(preview_bytes)
+    except OSError:
+        pass
+    
+    return preview_bytes
+
+def store_previews():
+    """Timer that stores finished previews"""
+    
+    for job in list(pending_previews):
+        hash, future = job
+        if not future.done():
+            continue
+        
+        pending_previews.remove(job)
+        if future.exception() is not None or future.result() is None:
+            continue
+        
+        preview_store[hash] = future.result()
+        tag_redraw_view3d()
+    
+    return 0.1 if pending_previews else None
+
+def queue_preview(obj, deltaworks_item, coords):
+    """Generates the preview of the provided version item from the flat vertex coordinates of its mesh in the background"""
+    
+    path = get_preview_path(obj, deltaworks_item.hash)
+    pending_previews.append((deltaworks_item.hash, preview_executor.submit(make_preview, coords, path)))
+    
+    if not bpy.app.timers.is_registered(store_previews):
+        bpy.app.timers.register(store_previews, first_interval=0.1)
+        
+def get_preview_path(obj, hash):
+    """Returns where the preview of the provided hash is written for obj's storage settings
+    
+    External previews live next to the deltas, packed previews in the packed cache.
+    """
+    
+    if obj.deltaworks_settings.storage == "EXTERNAL":
+        return pathlib.Path(obj.deltaworks_settings.external_location).joinpath(f"{hash}.preview")
+    
+    return pathlib.Path(packed_cache_location).joinpath(f"{hash}.preview")
+
+def get_preview_bytes(obj, deltaworks_item):
+    """Returns the compressed preview of the provided version item, or None if it has none"""
+    
+    if deltaworks_item.hash in preview_store:
+        return preview_store[deltaworks_item.hash]
+    
+    if deltaworks_item.preview != "":
+        return bytes.fromhex(deltaworks_item.preview)
+    
+    try:
+        preview_bytes = get_preview_path(obj, deltaworks_item.hash).read_bytes()
+    except OSError:
+        return None
+    
+    preview_store[deltaworks_item.hash] = preview_bytes
+    
+    return preview_bytes
+
+def set_preview_bytes(obj, hash, preview_bytes):
+    """Stores the compressed preview of the provided hash for obj's storage settings"""
+    
+    preview_store[hash] = preview_bytes
+    
+    path = get_preview_path(obj, hash)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(preview_bytes)
+        
+def get_preview_coords(obj, deltaworks_item):
+    """Returns the preview point cloud of the provided version item, or None if it has none"""
+    
+    preview_bytes = get_preview_bytes(obj, deltaworks_item)
+    if preview_bytes is None:
+        return None
+    
+    preview = numpy.frombuffer(zlib.decompress(preview_bytes), dtype=numpy.uint8)
+    low, high = numpy.frombuffer(preview[:24].tobytes(), dtype=numpy.float32).reshape(2, 3)
+    quantized = numpy.frombuffer(preview[24:].tobytes(), dtype=numpy.uint16).reshape(-1, 3)
+    
+    return (low + quantized.astype(numpy.float32) / 65535 * (high - low)).astype(numpy.float32)
+
+def tag_redraw_view3d():
+    """Tags every 3D View area for redraw"""
+    
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+                
+def update_selected(obj, context):
+    """Update callback for when the selected version changes"""
+    
+    count = len(obj.deltaworks_list)
+    if not 0 <= obj.deltaworks_selected < count:
+        return
+    
+    prefetch_versions(obj, [obj.deltaworks_selected - 1, obj.deltaworks_selected, obj.deltaworks_selected + 1])
+    
+    if obj.deltaworks_settings.show_diff and 0 <= obj.deltaworks_cur < count:
+        get_changed_verts(obj, obj.deltaworks_list[obj.deltaworks_selected].hash, obj.deltaworks_list[obj.deltaworks_cur].hash)
+        
+    tag_redraw_view3d()
+    
+    
+def delta_changed_verts(delta):
+    """Returns the indices of the vertices moved or added by a delta"""
+    
+    # A root version adds every vertex
+    if isinstance(delta, dict):
+        return numpy.arange(len(delta["verts"]))
+    
+    changed = []
+    for action, node, changes in delta:
+        path = node.split(".") if isinstance(node, str) else list(node)
+        if len(path) == 0 or path[0] != "verts":
+            continue
+        
+        if len(path) == 1:
+            if action == "add":
+                changed.extend([index for index, _ in changes])
+                
+        elif len(path) == 2 or path[2] == "co":
+            changed.append(int(path[1]))
+            
+    return numpy.unique(numpy.array(changed, dtype=numpy.int64))
+
+def get_lineage(obj, hash):
+    """Returns the hashes from the version with the provided hash up to its root"""
+    
+    parents = {item.hash: item.parent for item in obj.deltaworks_list}
+    lineage = []
+    
+    while hash != "":
+        lineage.append(hash)
+        hash = parents[hash]
+        
+    return lineage
+    
+def get_changed_verts(obj, hash1, hash2):
+    """Returns the indices of the vertices that differ between two versions without building either
+    
+    The indices are read from the deltas on the path between the versions on a worker thread,
+    and None is returned until they are ready. Every vertex counts as changed if the versions
+    share no ancestor.
+    """
+    
+    key = (hash1, hash2)
+    if key in changed_verts_results:
+        return changed_verts_results[key]
+    
+    if key in changed_verts_jobs:
+        return None
+    
+    items = {item.hash: item for item in obj.deltaworks_list}
+    lineage1 = get_lineage(obj, hash1)
+    lineage2 = get_lineage(obj, hash2)
+    
+    ancestors2 = set(lineage2)
+    common = [hash for hash in lineage1 if hash in ancestors2]
+    if len(common) == 0:
+        changed_verts_results[key] = numpy.arange(max(items[hash1].verts, items[hash2].verts))
+        return changed_verts_results[key]
+    
+    path = lineage1[:lineage1.index(common[0])] + lineage2[:lineage2.index(common[0])]
+    readers = [(hash, get_delta_reader(obj, items[hash])) for hash in path]
+    
+    changed_verts_jobs[key] = diff_executor.submit(compute_changed_verts, readers)
+    
+    if not bpy.app.timers.is_registered(store_changed_verts):
+        bpy.app.timers.register(store_changed_verts, first_interval=0.1)
+        
+    return None
+
+def compute_changed_verts(readers):
+    """Returns the union of the vertex indices changed by the deltas of the (hash, reader) pairs
+    
+    Runs on a worker thread.
+    """
+    
+    changed = [numpy.empty(0, dtype=numpy.int64)]
+    for hash, reader in readers:
+        verts = changed_verts_cache.get(hash)
+        
+        if verts is None:
+            verts = delta_changed_verts(pickle.loads(read_delta(hash, reader)))
+            
+            # Only the single diff worker touches the cache, so clearing it here is safe
+            if len(changed_verts_cache) >= changed_verts_cache_limit:
+                changed_verts_cache.clear()
+                
+            changed_verts_cache[hash] = verts
+            
+        changed.append(verts)
+            
+    return numpy.unique(numpy.concatenate(changed))
+
+def store_changed_verts():
+    """Timer that stores the finished changed vertex computations and redraws the viewport"""
+    
+    for key, future in list(changed_verts_jobs.items()):
+        if not future.done():
+            continue
+        
+        del changed_verts_jobs[key]
+        if future.exception() is not None:
+            continue
+        
+        if len(changed_verts_results) >= 16:
+            changed_verts_results.clear()
+            
+        changed_verts_results[key] = future.result()
+        tag_redraw_view3d()
+        
+    return 0.1 if changed_verts_jobs else None
+
+def shutdown_workers():
+    """Cancels pending background work, stops the worker threads and their polling timers"""
+    
+    futures = [future for hash, future in pending_previews]
+    futures += list(changed_verts_jobs.values())
+    futures += list(prefetch_futures)
+    futures += [job[-1] for job in auto_jobs.values()]
+    futures += [job[-1] for job in retention_jobs.values()]
+    
+    with delta_futures_lock:
+        futures += list(delta_futures.values())
+    
+    for future in futures:
+        future.cancel()
+        
+    pending_previews.clear()
+    changed_verts_jobs.clear()
+    prefetch_futures.clear()
+    auto_jobs.clear()
+    retention_jobs.clear()
+    
+    for executor in (delta_executor, prefetch_executor, diff_executor, preview_executor, auto_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+    for timer in (store_previews, store_changed_verts):
+        if bpy.app.timers.is_registered(timer):
+            bpy.app.timers.unregister(timer)
+
+
+def get_deltaworks_owners():
+    """Returns every datablock that holds versions"""
+    
+    return [owner for owner in list(bpy.data.objects) + list(bpy.data.meshes) if len(owner.deltaworks_list) > 0]
+
+def get_history_owner(obj):
+    """Returns the datablock that keeps the versions of the provided object
+    
+    This is the object's mesh if the history is shared with the mesh, otherwise the object itself.
+    """
+    
+    if isinstance(obj.data, bpy.types.Mesh) and obj.data.deltaworks_settings.history_scope == "MESH":
+        return obj.data
+    
+    return obj
+
+def get_mesh_users(mesh):
+    """Returns every object that uses the provided mesh"""
+    
+    return [obj for obj in bpy.data.objects if obj.data == mesh]
+
+def get_other_histories(obj):
+    """Returns the other users of obj's mesh that have their own versions
+    
+    They are split into those whose versions all appear in obj's history, like the copies left
+    by duplicating obj, and those with versions of their own.
+    """
+    
+    hashes = {item.hash for item in obj.deltaworks_list}
+    contained = []
+    diverged = []
+    
+    for other in get_mesh_users(obj.data):
+        if other == obj or len(other.deltaworks_list) == 0:
+            continue
+        
+        if all(item.hash in hashes for item in other.deltaworks_list):
+            contained.append(other)
+        else:
+            diverged.append(other)
+            
+    return contained, diverged
+
+def clear_history(obj):
+    """Removes every version of obj and releases their payloads"""
+    
+    rollback_migration(obj)
+    
+    for item in obj.deltaworks_list:
+        discard_delta_bytes(obj, item)
+        
+    obj.deltaworks_list.clear()
+    obj.property_unset("deltaworks_cur")
+    obj.property_unset("deltaworks_selected")
+
+def copy_property_group(src, dst):
+    """Copies every property of a deltaworks PropertyGroup onto another"""
+    
+    for prop in src.__annotations__:
+        setattr(dst, prop, getattr(src, prop))
+
+def move_history(src, dst):
+    """Moves the versions and settings of one datablock onto another
+    
+    Payloads are keyed by hash and the storage settings move along, so no delta is copied.
+    """
+    
+    for item in src.deltaworks_list:
+        copy_property_group(item, dst.deltaworks_list.add())
+    
+    copy_property_group(src.deltaworks_settings, dst.deltaworks_settings)
+    copy_property_group(src.deltaworks_settings, dst.deltaworks_tmpsettings)
+    dst.deltaworks_cur = src.deltaworks_cur
+    dst.deltaworks_selected = src.deltaworks_selected
+    
+    src.deltaworks_list.clear()
+    src.property_unset("deltaworks_cur")
+    src.property_unset("deltaworks_selected")
+    src.deltaworks_settings.history_scope = "OBJECT"
+    src.deltaworks_tmpsettings.history_scope = "OBJECT"
+
+@persistent
+def save_pre_handler(dummy):
+    """Writes the payloads into the .blend file right before it is saved"""
+    
+    for owner in get_deltaworks_owners():
+        for item in owner.deltaworks_list:
+            if owner.deltaworks_settings.storage == "PACKED":
+                # Payloads of a recovered autosave are only found in the packed cache
+                try:
+                    item.delta = get_delta_bytes(owner, item).hex()
+                except OSError:
+                    pass
+                
+                preview_bytes = get_preview_bytes(owner, item)
+                if preview_bytes is not None:
+                    item.preview = preview_bytes.hex()
+    
+@persistent
+def save_post_handler(dummy):
+    """Moves the payloads back out of the object datablocks once the file is saved"""
+    
+    saved_references.update(get_referenced_files())
+    unload_payloads()
+
+@persistent
+def load_post_handler(dummy):
+    """Moves the payloads of a loaded file out of the object datablocks"""
+    
+    saved_references.update(get_referenced_files())
+    unload_payloads()
+    
+def unload_payloads():
+    """Moves every payload held by an object datablock into the in-memory stores
+    
+    This also picks up the payloads of appended objects, for which load_post does not run.
+    """
+    
+    for owner in get_deltaworks_owners():
+        for item in owner.deltaworks_list:
+            if item.delta != "":
+                packed_store[item.hash] = bytes.fromhex(item.delta)
+                item.delta = ""
+                
+                try:
+                    write_packed_cache(item.hash, packed_store[item.hash])
+                except OSError:
+                    pass
+                
+            if item.preview != "":
+                preview_store[item.hash] = bytes.fromhex(item.preview)
+                item.preview = ""
+                
+                if owner.deltaworks_settings.storage == "PACKED":
+                    try:
+                        get_preview_path(owner, item.hash).write_bytes(preview_store[item.hash])
+                    except OSError:
+                        pass
+                
+@persistent
+def load_pre_handler(dummy):
+    """Drops the payloads of the outgoing file since its undo history is discarded"""
+    
+    purge_orphaned_files(live=False)
+    packed_store.clear()
+    preview_store.clear()
+    
+def get_referenced_files():
+    """Returns the external delta and preview files referenced by the versions currently loaded"""
+    
+    referenced = set()
+    for owner in get_deltaworks_owners():
+        if owner.deltaworks_settings.storage == "EXTERNAL":
+            p = pathlib.Path(owner.deltaworks_settings.external_location)
+            referenced.update([p.joinpath(f"{item.hash}.delta") for item in owner.deltaworks_list])
+            referenced.update([p.joinpath(f"{item.hash}.preview") for item in owner.deltaworks_list])
+            
+    return referenced
+    
+def purge_orphaned_files(live=True):
+    """Removes the orphaned external delta files that no saved file refers to
+    
+    This must only run once the undo history is discarded, since an undo step may still refer
+    to an orphaned file. If live is set, the files referenced by the loaded versions are kept too.
+    """
+    
+    referenced = saved_references | get_referenced_files() if live else saved_references
+    
+    for f in orphaned_files - referenced:
+        try:
+            f.unlink(missing_ok=True)
+        except OSError:
+            pass
+        
+    orphaned_files.clear()
+    
+    
+def capture_version(obj):
+    """Captures the mesh of obj and the chain of its current version
+    
+    Returns the bmesh_dict, the parent hash and the (hash, reader) pairs of the parent's chain,
+    which is everything encode_version needs, and the flat vertex coordinates for the preview.
+    """
+    
+    owner = get_history_owner(obj)
+    
+    bm = bmesh.new()
+    bm.from_mesh(obj.data)
+    bmesh_dict = bmesh_to_dict(bm)
+    bm.free()
+    
+    coords = numpy.empty(len(obj.data.vertices) * 3, dtype=numpy.float32)
+    obj.data.vertices.foreach_get("co", coords)
+    
+    if owner.deltaworks_cur < 0:
+        return bmesh_dict, "", [], coords
+    
+    parent = owner.deltaworks_list[owner.deltaworks_cur].hash
+    
+    return bmesh_dict, parent, [(item.hash, get_delta_reader(owner, item)) for item in get_chain_items(owner, parent)], coords
+
+def encode_version(bmesh_dict, readers, level):
+    """Diffs bmesh_dict against the parent built from readers and returns the compressed delta and raw size
+    
+    Does not touch Blender data so it can run on a worker thread.
+    """
+    
+    if len(readers) == 0:
+        ser_comp = zlib.compress(pickle.dumps(bmesh_dict), level)
+        return ser_comp, len(ser_comp)
+    
+    delta = diff(build_bmesh_dict_from_readers(readers), bmesh_dict)
+    
+    return zlib.compress(pickle.dumps(list(delta)), level), len(zlib.compress(pickle.dumps(bmesh_dict), level))
+
+def add_version(obj, parent, desc, ser_comp, raw_size, counts, fingerprint, coords, retention=True):
+    """Adds a version of obj's mesh to its history from the output of encode_version
+    
+    The preview is made from coords, the vertex coordinates returned by capture_version. If
+    retention is False the retention policy is left to the caller.
+    """
+    
+    owner = get_history_owner(obj)
+    new_item = owner.deltaworks_list.add()
+    
+    new_item.date = time.time()
+    new_item.desc = desc
+    new_item.parent = parent
+    new_item.hash = hashlib.md5(ser_comp).hexdigest().zfill(32)
+    set_delta_bytes(owner, new_item, ser_comp)
+    new_item.size = len(ser_comp)
+    new_item.raw_size = raw_size
+    
+    # populate mesh info
+    new_item.verts, new_item.edges, new_item.faces = counts
+    new_item.fingerprint = fingerprint
+    
+    owner.deltaworks_cur = list(owner.deltaworks_list).index(new_item)
+    owner.deltaworks_selected = owner.deltaworks_cur
+    
+    if retention and owner.deltaworks_settings.retention_enabled:
+        apply_retention_policy(owner)
+        
+    queue_preview(owner, owner.deltaworks_list[owner.deltaworks_cur], coords)
+    
+def new_version(obj, desc):
+    """Creates a new version of obj's mesh with the provided description"""
+    
+    owner = get_history_owner(obj)
+    bmesh_dict, parent, readers, coords = capture_version(obj)
+    ser_comp, raw_size = encode_version(bmesh_dict, readers, owner.deltaworks_settings.compression_value)
+    counts = (len(bmesh_dict["verts"]), len(bmesh_dict["edges"]), len(bmesh_dict["faces"]))
+    
+    add_version(obj, parent, desc, ser_comp, raw_size, counts, mesh_fingerprint(obj.data), coords)
+    
+def mesh_fingerprint(mesh):
+    """Returns a cheap fingerprint of a mesh's topology counts and vertex coordinates"""
+    
+    coords = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", coords)
+    
+    return f"{len(mesh.vertices)}/{len(mesh.edges)}/{len(mesh.polygons)}/{zlib.crc32(coords.tobytes()):08x}"
+
+def has_changed(obj, fingerprint=None):
+    """Returns True if obj's mesh differs from its current version"""
+    
+    owner = get_history_owner(obj)
+    if owner.deltaworks_cur < 0:
+        return True
+    
+    cur_item = owner.deltaworks_list[owner.deltaworks_cur]
+    mesh = obj.data
+    
+    # Compare the counts before hashing any coordinates
+    if (len(mesh.vertices), len(mesh.edges), len(mesh.polygons)) != (cur_item.verts, cur_item.edges, cur_item.faces):
+        return True
+    
+    return (fingerprint or mesh_fingerprint(mesh)) != cur_item.fingerprint
+
+def get_auto_version_targets(setting):
+    """Returns an (object, owner) pair for every history that has the provided auto versioning setting enabled"""
+    
+    targets = {}
+    for obj in bpy.data.objects:
+        if not isinstance(obj.data, bpy.types.Mesh) or obj.mode != "OBJECT":
+            continue
+        
+        owner = get_history_owner(obj)
+        if getattr(owner.deltaworks_settings, setting):
+            targets.setdefault((type(owner).__name__, owner.name_full), (obj, owner))
+            
+    return targets
+
+def is_auto_version_due(owner, now):
+    """Returns True if the rate limit allows another automatic version of owner"""
+    
+    last = max([item.date for item in owner.deltaworks_list], default=0)
+    
+    return now - last >= owner.deltaworks_settings.auto_interval * 60
+
+@persistent
+def auto_version_save_handler(dummy):
+    """Creates a version of every changed history that versions on save
+    
+    Registered before save_pre_handler so the new versions are written with the file.
+    """
+    
+    now = time.time()
+    for key, (obj, owner) in get_auto_version_targets("auto_on_save").items():
+        if key not in auto_jobs and is_auto_version_due(owner, now) and has_changed(obj):
+            new_version(obj, "Saved")
+
+def auto_version_timer():
+    """Timer that creates versions of changed histories in the background
+    
+    A history is only versioned once its mesh fingerprint has been stable for a whole check
+    interval and the rate limit allows it. The mesh is captured on the main thread, which is
+    why meshes above auto_max_verts are skipped, while diffing and compression run on a
+    worker thread. The retention policy is encoded on the same worker and applied on a later
+    tick. Each change pushes its own undo step.
+    """
+    
+    # Squash what the retention policy drops once it is encoded
+    for key, (obj_name, plan, future) in list(retention_jobs.items()):
+        if not future.done():
+            continue
+        
+        del retention_jobs[key]
+        obj = bpy.data.objects.get(obj_name)
+        if obj is None or future.exception() is not None:
+            continue
+        
+        # Drop the squash if the history changed while it was encoding, the next version plans it again
+        owner = get_history_owner(obj)
+        if {item.hash: item.parent for item in owner.deltaworks_list} == plan["parents"]:
+            apply_squash(owner, plan, future.result())
+            push_undo("DeltaWorks retention")
+    
+    # Add the versions whose encoding finished
+    for key, (obj_name, parent, counts, fingerprint, coords, future) in list(auto_jobs.items()):
+        if not future.done():
+            continue
+        
+        del auto_jobs[key]
+        obj = bpy.data.objects.get(obj_name)
+        if obj is None or future.exception() is not None:
+            continue
+        
+        # Drop the version if the history moved on while it was encoding
+        owner = get_history_owner(obj)
+        cur_hash = owner.deltaworks_list[owner.deltaworks_cur].hash if owner.deltaworks_cur >= 0 else ""
+        if cur_hash == parent:
+            add_version(obj, parent, "Automatic", *future.result(), counts, fingerprint, coords, retention=False)
+            push_undo("DeltaWorks auto version")
+            
+            # Rebuilding the squashed versions is as slow as encoding, so it runs on the worker too
+            plan = plan_squash(owner, get_structural_hashes(owner) | get_retained_hashes(owner)) if owner.deltaworks_settings.retention_enabled else None
+            if plan is not None:
+                future = auto_executor.submit(encode_squash, plan["rebased"], owner.deltaworks_settings.compression_value)
+                retention_jobs[key] = (obj_name, plan, future)
+    
+    now = time.time()
+    for key, (obj, owner) in get_auto_version_targets("auto_on_timer").items():
+        if key in auto_jobs or key in retention_jobs or not is_auto_version_due(owner, now):
+            continue
+        
+        # Capturing runs on the main thread, so large meshes are left to manual and on save versions
+        if len(obj.data.vertices) > owner.deltaworks_settings.auto_max_verts:
+            continue
+        
+        fingerprint = mesh_fingerprint(obj.data)
+        stable = auto_fingerprints.get(key) == fingerprint
+        auto_fingerprints[key] = fingerprint
+        
+        if stable and has_changed(obj, fingerprint):
+            bmesh_dict, parent, readers, coords = capture_version(obj)
+            counts = (len(bmesh_dict["verts"]), len(bmesh_dict["edges"]), len(bmesh_dict["faces"]))
+            future = auto_executor.submit(encode_version, bmesh_dict, readers, owner.deltaworks_settings.compression_value)
+            auto_jobs[key] = (obj.name, parent, counts, fingerprint, coords, future)
+            
+    return auto_check_interval
+
+def push_undo(message):
+    """Pushes an undo step for history changes made outside of an operator, like from a timer"""
+    
+    window = next(iter(bpy.context.window_manager.windows), None)
+    if window is None:
+        return
+    
+    if hasattr(bpy.context, "temp_override"):
+        with bpy.context.temp_override(window=window):
+            bpy.ops.ed.undo_push(message=message)
+    else:
+        bpy.ops.ed.undo_push({"window": window}, message=message)
+
+
+def check_delta(hash, reader):
+    """Reads a delta and returns the problems with its payload and the decompressed delta
+    
+    Runs on a worker thread. The payload is decoded directly rather than through the delta
+    cache so that cached bytes can not hide what is actually stored. The decompressed delta
+    is None if it can not be decoded.
+    """
+    
+    try:
+        delta_bytes = reader()
+    except OSError:
+        return ["missing payload"], None
+    
+    problems = []
+    if hashlib.md5(delta_bytes).hexdigest().zfill(32) != hash:
+        problems.append("hash mismatch")
         
+    try:
+        ser = zlib.decompress(delta_bytes)
+        pickle.loads(ser)
+    except (zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+        problems.append("undecodable")
+        ser = None
         
+    return problems, ser
+
+def verify_versions(obj):
+    """Verifies every version of obj and returns a dictionary of the problems found per hash
+    
+    Payloads are checked in parallel. Each version is then built from its parent's build, so
+    shared chain prefixes are only patched once and the cost is linear in the history size.
+    The walk reuses the deltas decompressed by the checks.
+    """
+    
+    items = {item.hash: item for item in obj.deltaworks_list}
+    problems = {hash: [] for hash in items}
+    
+    readers = {hash: get_delta_reader(obj, item) for hash, item in items.items()}
+    futures = {hash: delta_executor.submit(check_delta, hash, reader) for hash, reader in readers.items()}
+    
+    # Parent graph
+    children = {hash: [] for hash in items}
+    roots = []
+    for hash, item in items.items():
+        if item.parent == "":
+            roots.append(hash)
+        elif item.parent in items:
+            children[item.parent].append(hash)
+        else:
+            problems[hash].append("missing parent")
+            
+    sers = {}
+    for hash, future in futures.items():
+        problems[hash].extend(future.result()[0])
+        sers[hash] = future.result()[1]
+    
+    # Build every version reachable from a root, sharing the builds of common ancestors
+    built = set()
+    stack = [(hash, None, False) for hash in roots]
+    
+    while stack:
+        hash, bmesh_dict, copy = stack.pop()
+        built.add(hash)
+        ser = sers.pop(hash)
+        
+        if len(problems[hash]) > 0:
+            continue
+        
+        # Siblings copy their parent's build when they are reached, before the first child patches it in place
+        if copy:
+            bmesh_dict = pickle.loads(pickle.dumps(bmesh_dict))
+        
+        try:
+            delta = pickle.loads(ser)
+            if bmesh_dict is None:
+                bmesh_dict = delta
+            else:
+                patch(delta, bmesh_dict, in_place=True)
+                
+            counts = (len(bmesh_dict["verts"]), len(bmesh_dict["edges"]), len(bmesh_dict["faces"]))
+        except (pickle.UnpicklingError, KeyError, IndexError, TypeError, ValueError):
+            problems[hash].append("unbuildable")
+            continue
+        
+        item = items[hash]
+        if counts != (item.verts, item.edges, item.faces):
+            problems[hash].append(f"count mismatch {counts[0]}/{counts[1]}/{counts[2]}")
+            
+        # The first child is pushed first so it is popped last, after its siblings made their copies
+        for index, child in enumerate(children[hash]):
+            stack.append((child, bmesh_dict, index > 0))
+            
+    # Versions below a broken version or in a parent cycle are never reached
+    for hash in items:
+        if hash not in built and "missing parent" not in problems[hash]:
+            problems[hash].append("unreachable")
+            
+    return {hash: problem for hash, problem in problems.items() if len(problem) > 0}
+
+def repair_versions(obj, problems):
+    """Repairs the problems found by verify_versions and returns how many versions were removed
+    
+    Stored counts are corrected. Versions whose payload is missing or corrupt, including a
+    payload that no longer matches its hash, can not be built and are removed along with
+    their descendants. If the current version is removed, its nearest surviving ancestor,
+    or else the newest surviving version, becomes current.
+    """
+    
+    broken = {hash for hash, problem in problems.items()
+        if any([not p.startswith("count mismatch") for p in problem])}
+    
+    # Descendants of broken versions can not be built either
+    parents = {item.hash: item.parent for item in obj.deltaworks_list}
+    for hash in parents:
+        ancestor = hash
+        seen = set()
+        while ancestor in parents and ancestor not in broken and ancestor not in seen:
+            seen.add(ancestor)
+            ancestor = parents[ancestor]
+        if ancestor in broken or ancestor in seen:
+            broken.add(hash)
+    
+    cur_hash = obj.deltaworks_list[obj.deltaworks_cur].hash if obj.deltaworks_cur >= 0 else ""
+    selected_hash = obj.deltaworks_list[obj.deltaworks_selected].hash if 0 <= obj.deltaworks_selected < len(obj.deltaworks_list) else ""
+    
+    # Fall back to the nearest surviving ancestor of the current version
+    seen = set()
+    while cur_hash in broken and cur_hash not in seen:
+        seen.add(cur_hash)
+        cur_hash = parents.get(cur_hash, "")
+    
+    for item in obj.deltaworks_list:
+        if item.hash in broken or item.hash not in problems:
+            continue
+        
+        for problem in problems[item.hash]:
+            if problem.startswith("count mismatch"):
+                item.verts, item.edges, item.faces = [int(count) for count in problem.split(" ")[-1].split("/")]
+        
+    for index in reversed(range(len(obj.deltaworks_list))):
+        if obj.deltaworks_list[index].hash in broken:
+            discard_delta_bytes(obj, obj.deltaworks_list[index])
+            obj.deltaworks_list.remove(index)
+            
+    # Update cur and selected as required
+    delta_hashes = [item.hash for item in obj.deltaworks_list]
+    
+    if len(delta_hashes) == 0:
+        obj.property_unset("deltaworks_selected")
+        obj.property_unset("deltaworks_cur")
+        
+    else:
+        if cur_hash not in delta_hashes:
+            cur_hash = max(obj.deltaworks_list, key=lambda x: x.date).hash
+            
+        obj.deltaworks_cur = delta_hashes.index(cur_hash)
+        obj.deltaworks_selected = delta_hashes.index(selected_hash) if selected_hash in delta_hashes else min(obj.deltaworks_selected, len(delta_hashes) - 1)
         
+    return len(broken)